@@ -1,173 +1,151 @@
+from __future__ import annotations
+
 import re
+import io
+import os
+import operator
+import functools
+import json
+import sqlite3
 import pathlib
 import logging
+import logging.handlers
+import queue
 import datetime as dt
 import time
 import requests
-from typing import List, Dict, Optional, Tuple
-import traceback
+import requests.adapters
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import closing
+from typing import TYPE_CHECKING, Callable, List, Dict, Optional, Tuple
 import tkinter as tk
 from tkinter import ttk, scrolledtext
 import threading
 import fitz
 import pdfplumber
-import pandas as pd
-from openpyxl import load_workbook
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
                    handlers=[logging.FileHandler('logs/nfe_processor.log', encoding='utf-8')])
 logger = logging.getLogger(__name__)
 
-class TextHandler(logging.Handler):
-    def __init__(self, text_widget):
-        super().__init__()
-        self.text_widget = text_widget
+CNPJ_API_URL = "https://brasilapi.com.br/api/cnpj/v1/{cnpj}"
+CNPJ_API_INTERVALO = 0.3
+CNPJ_API_WORKERS = 8
+PDF_WORKERS = 4
+CNPJ_CACHE_VALIDADE = 30 * 24 * 60 * 60
+
+_PESOS_CNPJ_1 = (5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2)
+_PESOS_CNPJ_2 = (6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2)
+_DESLOCAMENTO_CNPJ_1 = ord('0') * sum(_PESOS_CNPJ_1)
+_DESLOCAMENTO_CNPJ_2 = ord('0') * sum(_PESOS_CNPJ_2)
+
+
+class _TabelaNumerica(dict):
+    def __missing__(self, codigo):
+        return None
+
+
+_NUMERIC_TABLE = _TabelaNumerica(dict.fromkeys(range(256)))
+_NUMERIC_TABLE.update({codigo: codigo for codigo in b'0123456789'})
+_NUMERIC_TABLE[ord(',')] = ord('.')
+
+_CNPJ_PARTES = re.compile(r'^(\d{2})(\d{3})(\d{3})(\d{4})(\d{2})$')
+_DATA_EMISSAO_PATTERN = re.compile(r"EMISS[ÃA]O[:\s]*([0-9]{2}/[0-9]{2}/[0-9]{4})", re.I)
+_NUMERO_NFE_PATTERN = re.compile(r"NF-e\s+N[ºº°]\s*(\d{1,9})", re.I)
+_NUMERO_SIMPLES_PATTERN = re.compile(r"N[ºº°]\s*(\d+)", re.I)
+_CNPJ_PATTERN = re.compile(r'(CNPJ\s*/\s*CPF[:\s]*)?(\d{2})\.?(\d{3})\.?(\d{3})\/?(\d{4})-?(\d{2})', re.I)
+_PDFPLUMBER_TABLE_SETTINGS = {
+    "vertical_strategy": "lines",
+    "horizontal_strategy": "lines",
+    "snap_tolerance": 3,
+}
 
+_COLUNAS_PLANILHA = [
+    "emit_razao_social", "emit_cnpj", "dest_razao_social", "dest_cnpj",
+    "numero_nfe", "data_emissao", "quantidade", "valor", "tipo_material", "descricao"
+]
+
+_MATERIAIS = (
+    ('PLASTICO', ('plastico', 'plástico', 'pet', 'pvc', 'pead', 'pebd', 'pp', 'ps',
+                  'polietileno', 'polipropileno', 'poliestireno')),
+    ('METAL', ('metal', 'ferro', 'aco', 'aço', 'ferroso', 'inox', 'inoxidavel',
+               'aluminio', 'alumínio', 'cobre', 'bronze', 'latao', 'latão',
+               'zinco', 'chumbo', 'sucata metalica', 'sucata metálica')),
+    ('VIDRO', ('vidro', 'cristal', 'garrafa vidro')),
+    ('PAPEL', ('papel', 'papelao', 'papelão', 'cartao', 'cartão')),
+)
+_MATERIAL_PATTERNS = tuple(
+    (tipo, re.compile("|".join(map(re.escape, palavras))))
+    for tipo, palavras in _MATERIAIS
+)
+_ITEM_PATTERN = re.compile(
+    r"(?P<codigo_item>\d{3})\s+"
+    r"(?P<descricao>[^\n]+?)\s+"
+    r"(?P<ncm>\d{8})\s+"
+    r"(?P<cst>\d{3})\s+"
+    r"(?P<cfop>\d{4})\s+"
+    r"(?P<unid>[A-Z]{2,4})\s+"
+    r"(?P<quantidade>[0-9\.\,]+)\s+"
+    r"(?P<valor_unit>[0-9\.\,]+)\s+"
+    r"(?P<valor_total>[0-9\.\,]+)"
+)
+
+class WorkerLogHandler(logging.Handler):
     def emit(self, record):
-        msg = self.format(record)
-        self.text_widget.configure(state='normal')
-        self.text_widget.insert(tk.END, msg + '\n')
-        self.text_widget.see(tk.END)
-        self.text_widget.configure(state='disabled')
+        nome = logger.name if record.name == "__mp_main__" else record.name
+        logging.getLogger(nome).handle(record)
 
-class NFeProcessorSimplified:
-    def __init__(self, log_widget=None):
-        self.base_dir = pathlib.Path(__file__).parent
-        self.input_dir = self.base_dir / "input"
-        self.output_dir = self.base_dir / "output" 
-        self.processed_dir = self.base_dir / "processed"
-        self.logs_dir = self.base_dir / "logs"
-        self.sheets_file = self.base_dir / "Sheets.xlsx"
-        
-        for dir_path in [self.input_dir, self.output_dir, self.processed_dir, self.logs_dir]:
-            dir_path.mkdir(exist_ok=True)
-        
-        self.cache_cnpj: Dict[str, Optional[Dict]] = {}
-        self._setup_patterns()
-        
-        if log_widget:
-            text_handler = TextHandler(log_widget)
-            text_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-            logger.addHandler(text_handler)
-    
-    def _setup_patterns(self):
-        self.patterns = {
-            'decimal_trans': str.maketrans({".": "", ",": "."}),
-            'cnpj': re.compile(r"\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}"),
-            'data_emissao': re.compile(r"EMISS[ÃA]O[:\s]*([0-9]{2}/[0-9]{2}/[0-9]{4})", re.I),
-            'numero_nfe': re.compile(r"NF-e\s+N[ºº°]\s*(\d{1,9})", re.I),
-            'numero_simples': re.compile(r"N[ºº°]\s*(\d+)", re.I),
-        }
-    
-    def _validar_cnpj(self, cnpj: str) -> bool:
-        if len(cnpj) != 14 or not cnpj.isdigit():
+class NFeParser:
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _validar_cnpj(cnpj: str) -> bool:
+        if len(cnpj) != 14 or not cnpj.isascii() or not cnpj.isdigit():
             return False
-            
-        def calc_digito(cnpj: str, pesos: List[int]) -> int:
-            soma = sum(int(cnpj[i]) * pesos[i] for i in range(len(pesos)))
+        
+        def calc_digito(soma: int) -> int:
             resto = soma % 11
             return 0 if resto < 2 else 11 - resto
-            
-        pesos1 = [5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]
-        pesos2 = [6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]
         
-        return (int(cnpj[12]) == calc_digito(cnpj, pesos1) and 
-                int(cnpj[13]) == calc_digito(cnpj, pesos2))
-    
-    def consultar_cnpj_api(self, cnpj: str) -> Optional[Dict]:
-        if not cnpj:
-            return None
-            
-        cnpj_limpo = re.sub(r'[^\d]', '', cnpj)
+        codigos = cnpj.encode('ascii')
+        digito1 = calc_digito(sum(map(operator.mul, codigos, _PESOS_CNPJ_1)) - _DESLOCAMENTO_CNPJ_1)
+        digito2 = calc_digito(sum(map(operator.mul, codigos, _PESOS_CNPJ_2)) - _DESLOCAMENTO_CNPJ_2)
         
-        if not self._validar_cnpj(cnpj_limpo):
-            return None
-            
-        if cnpj_limpo in self.cache_cnpj:
-            return self.cache_cnpj[cnpj_limpo]
-            
-        try:
-            time.sleep(0.3)
-            response = requests.get(f"https://brasilapi.com.br/api/cnpj/v1/{cnpj_limpo}", timeout=20)
-            
-            if response.status_code == 200:
-                dados = response.json()
-                resultado = {'razao_social': dados.get('razao_social', '').strip().upper()}
-                self.cache_cnpj[cnpj_limpo] = resultado
-                return resultado
-            else:
-                self.cache_cnpj[cnpj_limpo] = None
-                
-        except Exception as e:
-            logger.error(f"Erro ao consultar CNPJ {cnpj_limpo}: {e}")
-            self.cache_cnpj[cnpj_limpo] = None
-            
-        return None
+        return codigos[12] - 48 == digito1 and codigos[13] - 48 == digito2
     
-    def identificar_tipo_material(self, descricao: str) -> Optional[str]:
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def identificar_tipo_material(descricao: str) -> Optional[str]:
         if not descricao:
             return None
             
         desc_lower = descricao.lower()
         
-        if any(palavra in desc_lower for palavra in [
-            'plastico', 'plástico', 'pet', 'pvc', 'pead', 'pebd', 'pp', 'ps',
-            'polietileno', 'polipropileno', 'poliestireno'
-        ]):
-            return 'PLASTICO'
-        
-        elif any(palavra in desc_lower for palavra in [
-            'metal', 'ferro', 'aco', 'aço', 'ferroso', 'inox', 'inoxidavel', 
-            'aluminio', 'alumínio', 'cobre', 'bronze', 'latao', 'latão', 
-            'zinco', 'chumbo', 'sucata metalica', 'sucata metálica'
-        ]):
-            return 'METAL'
-        
-        elif any(palavra in desc_lower for palavra in ['vidro', 'cristal', 'garrafa vidro']):
-            return 'VIDRO'
-        
-        elif any(palavra in desc_lower for palavra in ['papel', 'papelao', 'papelão', 'cartao', 'cartão']):
-            return 'PAPEL'
+        for tipo, pattern in _MATERIAL_PATTERNS:
+            if pattern.search(desc_lower):
+                return tipo
         
         return None
     
-    def to_float(self, text: str) -> Optional[float]:
-        if not text or not isinstance(text, str):
-            return None
-        
-        try:
-            clean_text = re.sub(r'[^\d,.]', '', text.strip())
-            if not clean_text:
-                return None
-            return float(clean_text.translate(self.patterns['decimal_trans']))
-        except (ValueError, TypeError):
-            return None
-    
-    def extract_pdf_text(self, pdf_path: pathlib.Path) -> str:
-        try:
-            with fitz.open(pdf_path) as doc:
-                return "\n".join(page.get_text("text") for page in doc)
-        except Exception as e:
-            logger.error(f"Erro ao extrair texto do PDF {pdf_path}: {e}")
-            return ""
+    def extract_pdf_pages(self, doc: fitz.Document) -> List[str]:
+        return [page.get_text("text") for page in doc]
     
     def extract_cnpjs(self, text: str) -> Tuple[str, str]:
-        cnpjs = []
-        patterns = [
-            r'CNPJ\s*/\s*CPF[:\s]*(\d{2}\.?\d{3}\.?\d{3}\/?\d{4}-?\d{2})',
-            r'(\d{2}\.?\d{3}\.?\d{3}\/?\d{4}-?\d{2})',
-            r'(\d{14})'
-        ]
-        
-        for pattern in patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            for match in matches:
-                cnpj_limpo = re.sub(r'[^\d]', '', match)
-                if len(cnpj_limpo) == 14 and self._validar_cnpj(cnpj_limpo):
-                    cnpj_fmt = f"{cnpj_limpo[:2]}.{cnpj_limpo[2:5]}.{cnpj_limpo[5:8]}/{cnpj_limpo[8:12]}-{cnpj_limpo[12:14]}"
-                    if cnpj_fmt not in cnpjs:
-                        cnpjs.append(cnpj_fmt)
-        
+        rotulados = []
+        avulsos = []
+        
+        for match in _CNPJ_PATTERN.finditer(text):
+            cnpj_limpo = ''.join(match.group(2, 3, 4, 5, 6))
+            destino = rotulados if match.group(1) else avulsos
+            if cnpj_limpo not in destino and self._validar_cnpj(cnpj_limpo):
+                destino.append(cnpj_limpo)
+                if len(rotulados) == 2:
+                    break
+        
+        cnpjs = rotulados + [cnpj for cnpj in avulsos if cnpj not in rotulados]
         return (cnpjs[0] if cnpjs else "", cnpjs[1] if len(cnpjs) > 1 else "")
     
     def extract_metadata(self, text: str) -> Dict[str, any]:
@@ -180,15 +158,15 @@ class NFeProcessorSimplified:
             "dest_cnpj": ""
         }
         
-        nfe_match = self.patterns['numero_nfe'].search(text)
+        nfe_match = _NUMERO_NFE_PATTERN.search(text)
         if nfe_match:
             metadata["numero_nfe"] = nfe_match.group(1)
         else:
-            num_match = self.patterns['numero_simples'].search(text)
+            num_match = _NUMERO_SIMPLES_PATTERN.search(text)
             if num_match:
                 metadata["numero_nfe"] = num_match.group(1)
         
-        data_match = self.patterns['data_emissao'].search(text)
+        data_match = _DATA_EMISSAO_PATTERN.search(text)
         if data_match:
             try:
                 metadata["data_emissao"] = dt.datetime.strptime(data_match.group(1), "%d/%m/%Y").date()
@@ -199,59 +177,75 @@ class NFeProcessorSimplified:
         metadata["emit_cnpj"] = cnpj_emit
         metadata["dest_cnpj"] = cnpj_dest
         
-        if cnpj_emit:
-            dados_emit = self.consultar_cnpj_api(cnpj_emit)
-            if dados_emit:
-                metadata["emit_razao_social"] = dados_emit.get('razao_social', '')
+        return metadata
+    
+    def _extract_items_from_table(self, table: List[List]) -> List[Dict]:
+        items = []
+        if not table:
+            return items
         
-        if cnpj_dest:
-            dados_dest = self.consultar_cnpj_api(cnpj_dest)
-            if dados_dest:
-                metadata["dest_razao_social"] = dados_dest.get('razao_social', '')
+        header_found = False
+        for row in table:
+            if not row:
+                continue
+            
+            if not header_found and row[0] and "PROD" in str(row[0]).upper():
+                header_found = True
+                continue
+            
+            if not header_found:
+                continue
+            
+            if len(row) < 9:
+                continue
+            
+            descricao, ncm, quantidade, valor_total = row[1], row[2], row[6], row[8]
+            if not ncm or not descricao:
+                continue
+            
+            ncm = ncm.strip()
+            if len(ncm) != 8 or not ncm.isdigit():
+                continue
+            
+            descricao = descricao.strip()
+            tipo_material = self.identificar_tipo_material(descricao)
+            if not tipo_material:
+                continue
+            
+            item = {
+                'descricao': descricao,
+                'quantidade': (quantidade or "").strip(),
+                'valor': (valor_total or "").strip(),
+                'tipo_material': tipo_material
+            }
+            items.append(item)
         
-        return metadata
+        return items
+    
+    def extract_items_pymupdf(self, doc: fitz.Document, pages: Optional[List[int]] = None) -> List[Dict]:
+        items = []
+        
+        try:
+            for page_num in (pages if pages is not None else range(1, len(doc) + 1)):
+                for table in doc[page_num - 1].find_tables(strategy="lines", snap_tolerance=3).tables:
+                    items.extend(self._extract_items_from_table(table.extract()))
+        
+        except Exception as e:
+            logger.error(f"Erro ao extrair itens com PyMuPDF: {e}")
+        
+        return items
     
-    def extract_items_pdfplumber(self, pdf_path: pathlib.Path) -> List[Dict]:
+    def extract_items_pdfplumber(self, pdf_bytes: bytes, pages: Optional[List[int]] = None) -> List[Dict]:
         items = []
         
         try:
-            with pdfplumber.open(pdf_path) as pdf:
+            with pdfplumber.open(io.BytesIO(pdf_bytes), pages=pages, laparams=None) as pdf:
                 for page in pdf.pages:
-                    tables = page.extract_tables()
+                    tables = [table.extract() for table in page.find_tables(_PDFPLUMBER_TABLE_SETTINGS)]
+                    page.flush_cache()
                     
                     for table in tables:
-                        if not table:
-                            continue
-                        
-                        header_found = False
-                        for row in table:
-                            if not row:
-                                continue
-                            
-                            if not header_found and row[0] and "PROD" in str(row[0]).upper():
-                                header_found = True
-                                continue
-                            
-                            if not header_found:
-                                continue
-                            
-                            if (len(row) >= 9 and row[2] and 
-                                re.fullmatch(r"\d{8}", str(row[2]).strip())):
-                                
-                                descricao = str(row[1] or "").strip()
-                                quantidade = self.to_float(str(row[6] or "").strip())
-                                valor_total = self.to_float(str(row[8] or "").strip())
-                                
-                                tipo_material = self.identificar_tipo_material(descricao)
-                                
-                                if tipo_material:
-                                    item = {
-                                        'descricao': descricao,
-                                        'quantidade': quantidade,
-                                        'valor': valor_total,
-                                        'tipo_material': tipo_material
-                                    }
-                                    items.append(item)
+                        items.extend(self._extract_items_from_table(table))
         
         except Exception as e:
             logger.error(f"Erro ao extrair itens com pdfplumber: {e}")
@@ -261,64 +255,209 @@ class NFeProcessorSimplified:
     def extract_items_regex(self, text: str) -> List[Dict]:
         items = []
         
-        item_pattern = re.compile(
-            r"(?P<codigo_item>\d{3})\s+"
-            r"(?P<descricao>.+?)\s+"
-            r"(?P<ncm>\d{8})\s+"
-            r"(?P<cst>\d{3})\s+"
-            r"(?P<cfop>\d{4})\s+"
-            r"(?P<unid>[A-Z]{2,4})\s+"
-            r"(?P<quantidade>[0-9\.\,]+)\s+"
-            r"(?P<valor_unit>[0-9\.\,]+)\s+"
-            r"(?P<valor_total>[0-9\.\,]+)", re.S
-        )
-        
-        for match in item_pattern.finditer(text):
-            data = match.groupdict()
-            tipo_material = self.identificar_tipo_material(data.get('descricao', ''))
+        for match in _ITEM_PATTERN.finditer(text):
+            descricao, quantidade, valor_total = match.group('descricao', 'quantidade', 'valor_total')
+            tipo_material = self.identificar_tipo_material(descricao)
             
             if tipo_material:
                 item = {
-                    'descricao': data['descricao'],
-                    'quantidade': self.to_float(data['quantidade']),
-                    'valor': self.to_float(data['valor_total']),
+                    'descricao': descricao,
+                    'quantidade': quantidade,
+                    'valor': valor_total,
                     'tipo_material': tipo_material
                 }
                 items.append(item)
         
         return items
     
-    def process_pdf(self, pdf_path: pathlib.Path) -> List[Dict]:
-        logger.info(f"Processando: {pdf_path.name}")
-        
+    def parse_pdf(self, pdf_path: pathlib.Path) -> Tuple[Dict[str, any], List[Dict]]:
         try:
-            text = self.extract_pdf_text(pdf_path)
+            pdf_bytes = pdf_path.read_bytes()
+            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        except Exception as e:
+            logger.error(f"Erro ao abrir o PDF {pdf_path}: {e}")
+            return {}, []
+        
+        with doc:
+            try:
+                pages_text = self.extract_pdf_pages(doc)
+            except Exception as e:
+                logger.error(f"Erro ao extrair texto do PDF {pdf_path}: {e}")
+                return {}, []
+            
+            text = "\n".join(pages_text)
             if not text:
-                return []
+                return {}, []
             
             metadata = self.extract_metadata(text)
-            items = self.extract_items_pdfplumber(pdf_path)
+            paginas_itens = [num for num, page_text in enumerate(pages_text, start=1)
+                             if "NCM" in page_text.upper()] or None
+            items = self.extract_items_pymupdf(doc, paginas_itens)
             if not items:
                 items = self.extract_items_regex(text)
+            if not items:
+                items = self.extract_items_pdfplumber(pdf_bytes, paginas_itens)
+        
+        return metadata, items
+
+class NFeProcessorSimplified(NFeParser):
+    def __init__(self):
+        self.base_dir = pathlib.Path(__file__).parent
+        self.input_dir = self.base_dir / "input"
+        self.output_dir = self.base_dir / "output" 
+        self.processed_dir = self.base_dir / "processed"
+        self.logs_dir = self.base_dir / "logs"
+        self.config_dir = self.base_dir / "config"
+        self.sheets_file = self.base_dir / "Sheets.xlsx"
+        self.cnpj_cache_file = self.config_dir / "cnpj_cache.db"
+        
+        for dir_path in [self.input_dir, self.output_dir, self.processed_dir, self.logs_dir, self.config_dir]:
+            dir_path.mkdir(exist_ok=True)
+        
+        self.cache_cnpj: Dict[str, Optional[Dict]] = self._carregar_cache_cnpj()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=CNPJ_API_WORKERS)
+        self.session.mount("https://", adapter)
+        self._api_lock = threading.Lock()
+        self._proxima_consulta = 0.0
+    
+    def _carregar_cache_cnpj(self) -> Dict[str, Optional[Dict]]:
+        try:
+            with closing(sqlite3.connect(self.cnpj_cache_file)) as conn, conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS cnpj_cache "
+                             "(cnpj TEXT PRIMARY KEY, dados TEXT NOT NULL, atualizado_em REAL NOT NULL DEFAULT 0)")
+                
+                limite = time.time() - CNPJ_CACHE_VALIDADE
+                return {cnpj: json.loads(dados) for cnpj, dados in
+                        conn.execute("SELECT cnpj, dados FROM cnpj_cache WHERE atualizado_em >= ?", (limite,))}
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"Cache de CNPJ ignorado ({self.cnpj_cache_file.name}): {e}")
+            return {}
+    
+    def _gravar_cache_cnpj(self, cnpj: str, resultado: Dict):
+        try:
+            with closing(sqlite3.connect(self.cnpj_cache_file)) as conn, conn:
+                conn.execute("INSERT OR REPLACE INTO cnpj_cache (cnpj, dados, atualizado_em) VALUES (?, ?, ?)",
+                             (cnpj, json.dumps(resultado, ensure_ascii=False), time.time()))
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao gravar CNPJ {cnpj} no cache: {e}")
+    
+    def _aguardar_intervalo_api(self):
+        with self._api_lock:
+            agora = time.monotonic()
+            espera = self._proxima_consulta - agora
+            self._proxima_consulta = max(agora, self._proxima_consulta) + CNPJ_API_INTERVALO
+        
+        if espera > 0:
+            time.sleep(espera)
+    
+    def consultar_cnpj_api(self, cnpj: str) -> Optional[Dict]:
+        if not cnpj:
+            return None
             
-            for item in items:
-                item.update(metadata)
+        if not self._validar_cnpj(cnpj):
+            return None
             
-            if items:
-                tipos = set(item.get('tipo_material', '') for item in items)
-                logger.info(f"✓ {pdf_path.name} - {len(items)} itens ({', '.join(tipos)})")
+        if cnpj in self.cache_cnpj:
+            return self.cache_cnpj[cnpj]
             
-            return items
+        try:
+            self._aguardar_intervalo_api()
+            response = self.session.get(CNPJ_API_URL.format(cnpj=cnpj), timeout=20)
             
+            if response.status_code == 200:
+                dados = response.json()
+                resultado = {'razao_social': dados.get('razao_social', '').strip().upper()}
+                self.cache_cnpj[cnpj] = resultado
+                self._gravar_cache_cnpj(cnpj, resultado)
+                return resultado
+            else:
+                self.cache_cnpj[cnpj] = None
+                
         except Exception as e:
-            logger.error(f"❌ Erro ao processar {pdf_path.name}: {e}")
-            return []
+            logger.error(f"Erro ao consultar CNPJ {cnpj}: {e}")
+            self.cache_cnpj[cnpj] = None
+            
+        return None
+    
+    def agendar_consultas_cnpj(self, executor: ThreadPoolExecutor, agendados: set, metadata: Dict[str, any]):
+        for campo in ("emit_cnpj", "dest_cnpj"):
+            cnpj = metadata.get(campo)
+            if cnpj and cnpj not in agendados and cnpj not in self.cache_cnpj:
+                agendados.add(cnpj)
+                executor.submit(self.consultar_cnpj_api, cnpj)
+    
+    def preencher_razao_social(self, metadata: Dict[str, any]) -> None:
+        if metadata.get("emit_cnpj"):
+            dados_emit = self.consultar_cnpj_api(metadata["emit_cnpj"])
+            if dados_emit:
+                metadata["emit_razao_social"] = dados_emit.get('razao_social', '')
+        
+        if metadata.get("dest_cnpj"):
+            dados_dest = self.consultar_cnpj_api(metadata["dest_cnpj"])
+            if dados_dest:
+                metadata["dest_razao_social"] = dados_dest.get('razao_social', '')
+    
+    def _finalizar_itens(self, metadata: Dict[str, any], items: List[Dict]) -> List[Dict]:
+        if not items:
+            return items
+        
+        self.preencher_razao_social(metadata)
+        for item in items:
+            item.update(metadata)
+        return items
+    
+    def _parse_pdfs(self, pdf_files: List[pathlib.Path],
+                    ao_concluir: Callable[[pathlib.Path, Tuple[Dict[str, any], List[Dict]]], None]
+                    ) -> Dict[pathlib.Path, Tuple[Dict[str, any], List[Dict]]]:
+        resultados = {}
+        workers = min(os.cpu_count() or 1, PDF_WORKERS, len(pdf_files))
+        
+        if workers <= 1:
+            for pdf_path in pdf_files:
+                logger.info(f"Processando: {pdf_path.name}")
+                try:
+                    resultados[pdf_path] = self.parse_pdf(pdf_path)
+                except Exception as e:
+                    logger.error(f"❌ Erro ao processar {pdf_path.name}: {e}")
+                    continue
+                ao_concluir(pdf_path, resultados[pdf_path])
+            return resultados
+        
+        contexto = multiprocessing.get_context("spawn")
+        fila_logs = contexto.Queue()
+        listener = logging.handlers.QueueListener(fila_logs, WorkerLogHandler())
+        listener.start()
+        
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=contexto,
+                                     initializer=_inicializar_worker, initargs=(fila_logs,)) as executor:
+                futures = {}
+                for pdf_path in pdf_files:
+                    logger.info(f"Processando: {pdf_path.name}")
+                    futures[executor.submit(_worker_process_pdf, pdf_path)] = pdf_path
+                
+                for future in as_completed(futures):
+                    pdf_path = futures[future]
+                    try:
+                        resultados[pdf_path] = future.result()
+                    except Exception as e:
+                        logger.error(f"❌ Erro ao processar {pdf_path.name}: {e}")
+                        continue
+                    ao_concluir(pdf_path, resultados[pdf_path])
+        finally:
+            listener.stop()
+        
+        return resultados
     
     def process_all_pdfs(self) -> Tuple[List[Dict], List[str]]:
         all_items = []
         failed_files = []
         
-        pdf_files = sorted(self.input_dir.glob("*.pdf"))
+        with os.scandir(self.input_dir) as entries:
+            pdf_files = [pathlib.Path(entry.path) for entry in entries
+                         if entry.name.lower().endswith('.pdf') and entry.is_file()]
+        pdf_files.sort()
         
         if not pdf_files:
             logger.warning("Nenhum arquivo PDF encontrado na pasta 'input'")
@@ -326,33 +465,53 @@ class NFeProcessorSimplified:
         
         logger.info(f"Processando {len(pdf_files)} arquivos PDF")
         
+        agendados = set()
+        with self.session, ThreadPoolExecutor(max_workers=CNPJ_API_WORKERS) as consultas:
+            def agendar_consultas(pdf_path: pathlib.Path, resultado: Tuple[Dict[str, any], List[Dict]]):
+                metadata, items = resultado
+                if items:
+                    tipos = set(item.get('tipo_material', '') for item in items)
+                    logger.info(f"✓ {pdf_path.name} - {len(items)} itens ({', '.join(tipos)})")
+                    self.agendar_consultas_cnpj(consultas, agendados, metadata)
+            
+            resultados = self._parse_pdfs(pdf_files, agendar_consultas)
+        
+        if agendados:
+            logger.info(f"Consultados {len(agendados)} CNPJs na API")
+        
         for pdf_path in pdf_files:
+            metadata, items = resultados.get(pdf_path, ({}, []))
+            items = self._finalizar_itens(metadata, items)
+            if not items:
+                failed_files.append(pdf_path.name)
+                continue
+            
             try:
-                items = self.process_pdf(pdf_path)
-                if items:
-                    all_items.extend(items)
-                    processed_path = self.processed_dir / pdf_path.name
-                    pdf_path.rename(processed_path)
-                else:
-                    failed_files.append(pdf_path.name)
+                all_items.extend(items)
+                processed_path = self.processed_dir / pdf_path.name
+                pdf_path.rename(processed_path)
             except Exception as e:
                 failed_files.append(pdf_path.name)
                 logger.error(f"Falha ao processar {pdf_path.name}: {e}")
         
         return all_items, failed_files
     
-    def save_to_sheets(self, items: List[Dict]) -> pathlib.Path:
+    def _finalize_numerics(self, df: pd.DataFrame) -> pd.DataFrame:
+        import pandas as pd
+        
+        for coluna in ('quantidade', 'valor'):
+            if coluna in df.columns:
+                df[coluna] = pd.to_numeric(df[coluna].str.translate(_NUMERIC_TABLE), errors='coerce')
+        return df
+    
+    def _formatar_cnpjs(self, df: pd.DataFrame) -> pd.DataFrame:
+        for coluna in ('emit_cnpj', 'dest_cnpj'):
+            if coluna in df.columns:
+                df[coluna] = df[coluna].str.replace(_CNPJ_PARTES, r'\1.\2.\3/\4-\5', regex=True)
+        return df
+    
+    def save_to_sheets(self, df: pd.DataFrame) -> pathlib.Path:
         try:
-            df = pd.DataFrame(items)
-            
-            columns_order = [
-                "emit_razao_social", "emit_cnpj", "dest_razao_social", "dest_cnpj",
-                "numero_nfe", "data_emissao", "quantidade", "valor", "tipo_material", "descricao"
-            ]
-            
-            existing_cols = [col for col in columns_order if col in df.columns]
-            df = df[existing_cols]
-            
             df = df.rename(columns={
                 'emit_razao_social': 'Razão Social Emitente',
                 'emit_cnpj': 'CNPJ Emitente',
@@ -364,56 +523,23 @@ class NFeProcessorSimplified:
                 'valor': 'Valor Total',
                 'tipo_material': 'Tipo Material',
                 'descricao': 'Descrição'
-            })
+            }, copy=False)
+            
+            resumo = df.groupby('Tipo Material').agg({
+                'Quantidade': 'sum',
+                'Valor Total': 'sum',
+                'Número NFe': 'count'
+            }).rename(columns={'Número NFe': 'Qtd Registros'})
+            
+            larguras = self._larguras_colunas(df)
             
             if self.sheets_file.exists():
                 try:
-                    with pd.ExcelWriter(self.sheets_file, mode='a', if_sheet_exists='replace', engine='openpyxl') as writer:
-                        df.to_excel(writer, sheet_name='lancamentos_nf', index=False)
-                        
-                        resumo = df.groupby('Tipo Material').agg({
-                            'Quantidade': 'sum',
-                            'Valor Total': 'sum',
-                            'Número NFe': 'count'
-                        }).rename(columns={'Número NFe': 'Qtd Registros'})
-                        resumo.to_excel(writer, sheet_name='Resumo_por_Material')
-                    
-                    wb = load_workbook(self.sheets_file)
-                    if 'lancamentos_nf' in wb.sheetnames:
-                        worksheet = wb['lancamentos_nf']
-                        for column in worksheet.columns:
-                            max_length = max(len(str(cell.value)) for cell in column if cell.value)
-                            worksheet.column_dimensions[column[0].column_letter].width = min(max_length + 2, 50)
-                        wb.save(self.sheets_file)
-                    
+                    self._atualizar_planilha(df, resumo, larguras)
                 except Exception:
-                    with pd.ExcelWriter(self.sheets_file, engine='openpyxl') as writer:
-                        df.to_excel(writer, sheet_name='lancamentos_nf', index=False)
-                        
-                        resumo = df.groupby('Tipo Material').agg({
-                            'Quantidade': 'sum',
-                            'Valor Total': 'sum',
-                            'Número NFe': 'count'
-                        }).rename(columns={'Número NFe': 'Qtd Registros'})
-                        resumo.to_excel(writer, sheet_name='Resumo_por_Material')
+                    self._criar_planilha(df, resumo, larguras)
             else:
-                with pd.ExcelWriter(self.sheets_file, engine='openpyxl') as writer:
-                    df.to_excel(writer, sheet_name='lancamentos_nf', index=False)
-                    
-                    resumo = df.groupby('Tipo Material').agg({
-                        'Quantidade': 'sum',
-                        'Valor Total': 'sum',
-                        'Número NFe': 'count'
-                    }).rename(columns={'Número NFe': 'Qtd Registros'})
-                    resumo.to_excel(writer, sheet_name='Resumo_por_Material')
-                
-                wb = load_workbook(self.sheets_file)
-                if 'lancamentos_nf' in wb.sheetnames:
-                    worksheet = wb['lancamentos_nf']
-                    for column in worksheet.columns:
-                        max_length = max(len(str(cell.value)) for cell in column if cell.value)
-                        worksheet.column_dimensions[column[0].column_letter].width = min(max_length + 2, 50)
-                    wb.save(self.sheets_file)
+                self._criar_planilha(df, resumo, larguras)
             
             logger.info(f"✔ Dados salvos em: {self.sheets_file}")
             return self.sheets_file
@@ -422,18 +548,68 @@ class NFeProcessorSimplified:
             logger.error(f"Erro ao salvar dados: {e}")
             raise
     
+    def _larguras_colunas(self, df: pd.DataFrame) -> Dict[str, float]:
+        from openpyxl.utils import get_column_letter
+        
+        tamanhos = df.astype(str).apply(lambda coluna: coluna.str.len()).max().fillna(0)
+        cabecalhos = df.columns.to_series().astype(str).str.len()
+        larguras = tamanhos.where(tamanhos > cabecalhos, cabecalhos).clip(upper=48) + 2
+        return {get_column_letter(i): largura for i, largura in enumerate(larguras.tolist(), start=1)}
+    
+    def _atualizar_planilha(self, df: pd.DataFrame, resumo: pd.DataFrame, larguras: Dict[str, float]):
+        import pandas as pd
+        
+        with pd.ExcelWriter(self.sheets_file, mode='a', if_sheet_exists='replace', engine='openpyxl') as writer:
+            df.to_excel(writer, sheet_name='lancamentos_nf', index=False)
+            resumo.to_excel(writer, sheet_name='Resumo_por_Material')
+            
+            worksheet = writer.sheets['lancamentos_nf']
+            for letra, largura in larguras.items():
+                worksheet.column_dimensions[letra].width = largura
+    
+    def _criar_planilha(self, df: pd.DataFrame, resumo: pd.DataFrame, larguras: Dict[str, float]):
+        from openpyxl import Workbook
+        
+        wb = Workbook(write_only=True)
+        
+        worksheet = wb.create_sheet('lancamentos_nf')
+        for letra, largura in larguras.items():
+            worksheet.column_dimensions[letra].width = largura
+        self._escrever_linhas(worksheet, df)
+        
+        self._escrever_linhas(wb.create_sheet('Resumo_por_Material'), resumo.reset_index())
+        wb.save(self.sheets_file)
+    
+    def _escrever_linhas(self, worksheet, df: pd.DataFrame):
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font
+        
+        cabecalho = []
+        for coluna in df.columns:
+            cell = WriteOnlyCell(worksheet, value=coluna)
+            cell.font = Font(bold=True)
+            cabecalho.append(cell)
+        worksheet.append(cabecalho)
+        
+        valores = df.astype(object).where(df.notna(), None)
+        for row in valores.itertuples(index=False, name=None):
+            worksheet.append(row)
+    
     def run(self):
         logger.info("INICIANDO PROCESSAMENTO - MATERIAIS RECICLÁVEIS")
         
         all_items, failed_files = self.process_all_pdfs()
         
         if all_items:
-            output_file = self.save_to_sheets(all_items)
+            import pandas as pd
+            
+            df = self._formatar_cnpjs(self._finalize_numerics(
+                pd.DataFrame.from_records(all_items, columns=_COLUNAS_PLANILHA)))
+            output_file = self.save_to_sheets(df)
             logger.info(f"✅ {len(all_items)} itens processados - {output_file}")
             
-            df = pd.DataFrame(all_items)
             materiais = df['tipo_material'].value_counts()
-            valor_total = df['valor'].sum() if 'valor' in df.columns else 0
+            valor_total = df['valor'].sum()
             
             logger.info(f"Valor total: R$ {valor_total:,.2f}")
             for material, qtd in materiais.items():
@@ -446,6 +622,21 @@ class NFeProcessorSimplified:
         
         logger.info("Processamento concluído!")
 
+_worker_parser: Optional[NFeParser] = None
+
+def _inicializar_worker(fila_logs: multiprocessing.Queue):
+    global _worker_parser
+    raiz = logging.getLogger()
+    for handler in raiz.handlers[:]:
+        raiz.removeHandler(handler)
+        handler.close()
+    raiz.addHandler(logging.handlers.QueueHandler(fila_logs))
+    
+    _worker_parser = NFeParser()
+
+def _worker_process_pdf(pdf_path: pathlib.Path) -> Tuple[Dict[str, any], List[Dict]]:
+    return _worker_parser.parse_pdf(pdf_path)
+
 class NFeProcessorGUI:
     def __init__(self, root):
         self.root = root
@@ -472,12 +663,40 @@ class NFeProcessorGUI:
         self.main_frame.rowconfigure(1, weight=1)
         
         self.is_processing = False
+        self._estava_processando = False
+        
+        self.log_queue = queue.Queue()
+        queue_handler = logging.handlers.QueueHandler(self.log_queue)
+        queue_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        logger.addHandler(queue_handler)
+        self.root.after(100, self._drain_log_queue)
+    
+    def _drain_log_queue(self, max_records: int = 200):
+        msgs = []
+        try:
+            while len(msgs) < max_records:
+                msgs.append(self.log_queue.get_nowait().getMessage())
+        except queue.Empty:
+            pass
+        
+        if msgs:
+            self.log_text.configure(state='normal')
+            self.log_text.insert(tk.END, '\n'.join(msgs) + '\n')
+            self.log_text.see(tk.END)
+            self.log_text.configure(state='disabled')
+        
+        if self._estava_processando and not self.is_processing:
+            self._estava_processando = False
+            self.process_button.configure(state='normal')
+        
+        self.root.after(100, self._drain_log_queue)
     
     def start_processing(self):
         if self.is_processing:
             return
         
         self.is_processing = True
+        self._estava_processando = True
         self.process_button.configure(state='disabled')
         
         self.log_text.configure(state='normal')
@@ -488,13 +707,12 @@ class NFeProcessorGUI:
     
     def run_processing(self):
         try:
-            processor = NFeProcessorSimplified(self.log_text)
+            processor = NFeProcessorSimplified()
             processor.run()
         except Exception as e:
             logger.error(f"Erro fatal: {e}")
         finally:
             self.is_processing = False
-            self.process_button.configure(state='normal')
 
 def main():
     root = tk.Tk()